@@ -4,17 +4,21 @@
 Agent A (UDP) — Probe Client + Per-Minute Aggregation + MQTT Publisher
 
 WHAT THIS PROGRAM DOES
-- Sends small JSON “probe” packets over **UDP** to Agent B at a fixed rate (RATE_HZ).
+- Sends small fixed-layout binary “probe” packets (27 bytes, see PROBE) over **UDP** to Agent B at a fixed rate (RATE_HZ), from a
+  dedicated send thread that sleeps until each absolute tick.
 - Measures **RTT** on echoed packets, derives **jitter**, and aggregates stats in **1-minute windows**.
 - After each minute (with a **+TIMEOUT_S grace** so on-time late echoes can arrive), publishes one
-  JSON record to **MQTT** on topic:  netstats/<agent_id>/minute  (QoS 0, no retain).
+  JSON record to **MQTT** on topic:  netstats/<agent_id>/minute  (QoS 0, no retain)
+  over one persistent client (loop_start background thread, auto-reconnect).
 
 """
 
-import json, socket, time, uuid
-from statistics import mean
+import array, ctypes, errno, json, select, socket, struct, sys, threading, time, uuid
+from math import inf
 from pathlib import Path
 from paho.mqtt import client as mqtt
+from minute_stats import minute_iso, summarize
+from udp_mmsg import HAVE_RECVMMSG, HAVE_SENDMMSG, RecvBatch, SendBatch, set_socket_buffers
 
 # Configuration 
 HOST = "127.0.0.1"      # Agent B UDP host
@@ -22,11 +26,21 @@ PORT = 4401             # Agent B UDP port
 RATE_HZ = 2.0           # 2 probes/sec
 TIMEOUT_S = 2.0         # echo deadline for "on-time" receives
 PERIOD = 1.0 / RATE_HZ
+BATCH_MIN_HZ = 50.0     # at/above this rate, overdue probes go out in one sendmmsg() (Linux)
+SEND_BATCH_MAX = 64     # max probes per sendmmsg() call
+USE_RECVMMSG = False    # drain echoes with one recvmmsg() per loop (Linux); small win at low rates
+RECV_BATCH_MAX = 32     # max echoes per recvmmsg() call
+SOCK_BUF_BYTES = 2 << 20  # 2 MB send/recv buffers so bursts aren't dropped and counted as loss
 
 MQTT_HOST = "127.0.0.1"
 MQTT_PORT = 1883
 STATE_DIR = Path.home() / ".agent_a"
 
+# probe wire format (network byte order): version u8, agent UUID 16 bytes, seq u16, t_send_ns u64.
+# Agent B echoes it verbatim; packing/unpacking is a single C call with no parser involved.
+PROBE = struct.Struct("!B16sHQ")
+PROBE_VERSION = 1
+
 # create or load unique agent ID
 def load_or_create_agent_id(state_dir: Path = STATE_DIR) -> str:
     state_dir.mkdir(parents=True, exist_ok=True)
@@ -37,6 +51,36 @@ def load_or_create_agent_id(state_dir: Path = STATE_DIR) -> str:
     f.write_text(aid)
     return aid
 
+# pack seq + timestamp into the reusable probe buffer (no dict, no serializer, no encode)
+def build_frame(seq: int, t_send_ns: int) -> bytearray:
+    PROBE.pack_into(probe_buf, 0, PROBE_VERSION, agent_uuid_bytes, seq, t_send_ns)
+    return probe_buf
+
+# absolute-deadline sleep on CLOCK_MONOTONIC (the clock behind time.monotonic_ns), so the send
+# cadence never drifts by the work done per tick; portable fallback is a relative time.sleep()
+class _timespec(ctypes.Structure):
+    _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+_clock_nanosleep = None
+if sys.platform.startswith("linux"):
+    try:
+        _clock_nanosleep = ctypes.CDLL(None, use_errno=True).clock_nanosleep
+        _clock_nanosleep.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.POINTER(_timespec), ctypes.c_void_p]
+        _clock_nanosleep.restype = ctypes.c_int
+    except (OSError, AttributeError):
+        _clock_nanosleep = None
+TIMER_ABSTIME = 1
+
+def sleep_until_ns(target_ns: int) -> None:
+    if _clock_nanosleep is not None:
+        ts = _timespec(target_ns // 1_000_000_000, target_ns % 1_000_000_000)
+        while _clock_nanosleep(time.CLOCK_MONOTONIC, TIMER_ABSTIME, ctypes.byref(ts), None) == errno.EINTR:
+            pass
+    else:
+        delay = (target_ns - time.monotonic_ns()) / 1e9
+        if delay > 0:
+            time.sleep(delay)
+
 # MQTT (Paho v1/v2 compatible) establish client 
 def _make_mqtt_client():
     # Support both paho-mqtt v1.x and v2.x without breaking
@@ -45,149 +89,257 @@ def _make_mqtt_client():
         return mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2)
     except AttributeError:
         return mqtt.Client()
-    
-# publish to MQTT broker
-def publish_mqtt(agent_id: str, payload: dict):
-    topic = f"netstats/{agent_id}/minute"
+
+# log broker drops; Paho's network thread reconnects on its own
+def _on_mqtt_disconnect(client, userdata, *args):
+    # v1: (rc,)  v2: (disconnect_flags, reason_code, properties)
+    rc = args[1] if len(args) >= 2 else (args[0] if args else None)
+    print(f"[MQTT] disconnected rc={getattr(rc, 'value', rc)}; reconnecting in background")
+
+# one persistent client for the life of the process (no CONNECT/DISCONNECT per minute)
+def start_mqtt_client():
     c = _make_mqtt_client()
+    c.on_disconnect = _on_mqtt_disconnect
+    c.reconnect_delay_set(min_delay=1, max_delay=30)
+    c.connect_async(MQTT_HOST, MQTT_PORT, keepalive=60)
+    c.loop_start()  # background thread handles network I/O + reconnects
+    return c
+
+# publish to MQTT broker (non-blocking: queued for the network thread)
+def publish_mqtt(topic: str, payload_bytes: bytes):
     try:
-        c.connect(MQTT_HOST, MQTT_PORT, keepalive=10)
-        c.publish(topic, json.dumps(payload, separators=(",", ":")), qos=0, retain=False)
-        c.disconnect()
+        mqtt_client.publish(topic, payload_bytes, qos=0, retain=False)
     except Exception as e:
         print(f"[MQTT] publish failed: {e}")
 
 # UDP socket setup to send/receive probes
-def make_udp_socket(recv_timeout_s: float = 0.05) -> socket.socket:
+def make_udp_socket() -> socket.socket:
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    s.settimeout(recv_timeout_s)  # short timeout → non-blocking-ish poll
-    print(f"[Agent A] Using UNCONNECTED UDP to {HOST}:{PORT} (recv timeout {recv_timeout_s}s)")
+    set_socket_buffers(s, SOCK_BUF_BYTES)
+    s.connect((HOST, PORT))  # cache route + peer once; kernel drops datagrams from other sources
+    s.setblocking(False)     # the main loop waits in select(), recv never blocks
+    print(f"[Agent A] Using CONNECTED non-blocking UDP to {HOST}:{PORT}")
     return s
 
 # test connectivity, run agent_b.py first
 agent_id = load_or_create_agent_id()
-sock = make_udp_socket(0.05)
+mqtt_client = start_mqtt_client()
+mqtt_topic = f"netstats/{agent_id}/minute"   # built once, reused every minute
+agent_uuid_bytes = uuid.UUID(agent_id).bytes
+probe_buf = bytearray(PROBE.size)             # reused for every probe
+sock = make_udp_socket()
+recv_buf = bytearray(2048)                    # every echo lands here; no bytes object per recv
+recv_view = memoryview(recv_buf)
+send_batch = SendBatch(SEND_BATCH_MAX) if (RATE_HZ >= BATCH_MIN_HZ and HAVE_SENDMMSG) else None
+recv_batch = RecvBatch(RECV_BATCH_MAX) if (USE_RECVMMSG and HAVE_RECVMMSG) else None
 print(f"[Agent A] Ready (agent_id={agent_id})")
 
-seq = 0
-latencies, jitters = [], []
-sent = 0           # number of probes we attempted this minute
-received = 0       # number of echoes that arrived within TIMEOUT_S this minute
-# NOTE: there is NO running 'lost' counter anymore — we derive it at finalize.
-prev_rtt = None
-
-current_minute = int(time.time() // 60) * 60  # minute-aligned window
-in_flight = {}                                # seq -> t_send_ns (tracks outstanding probes)
-next_send = time.monotonic()                  # fixed-rate scheduler tick
+seq = 0            # next seq to send (owned by the send thread)
+sent_total = 0     # probes attempted since startup (owned by the send thread)
+# ring indexed by 16-bit seq -> t_send_ns (0 = not outstanding); the send thread stores,
+# the main thread loads/clears. Single 8-byte item writes are atomic under the GIL.
+in_flight = array.array("q", [0] * 65536)
 
-last_sweep_ns = time.monotonic_ns()
 SWEEP_NS = int(0.25 * 1e9)                    # sweep every 250ms (for memory hygiene ONLY)
+TIMEOUT_NS = int(TIMEOUT_S * 1e9)
+PERIOD_NS = int(PERIOD * 1e9)
 
-# loop forever: fixed-rate SEND, non-blocking RECV, minute FINALIZE
-while True:
-    now_wall = time.time()
-    now_mono = time.monotonic()
-
-    # Minute finalize WITH +TIMEOUT_S grace so on-time late echoes can still be counted.
-    if now_wall >= current_minute + 60 + TIMEOUT_S:
-        # OPTION A: compute lost exactly once here
-        computed_lost = max(0, sent - received)
-
-        result = {
-            "agent_id": agent_id,
-            "time": time.strftime("%Y-%m-%dT%H:%M:00Z", time.gmtime(current_minute)),
-            "latency_min_ms": round(min(latencies), 3) if latencies else 0.0,
-            "latency_max_ms": round(max(latencies), 3) if latencies else 0.0,
-            "latency_avg_ms": round(mean(latencies), 3) if latencies else 0.0,
-            "jitter_min_ms":  round(min(jitters), 3) if jitters else 0.0,
-            "jitter_max_ms":  round(max(jitters), 3) if jitters else 0.0,
-            "jitter_avg_ms":  round(mean(jitters), 3) if jitters else 0.0,
-            "sent": sent,
-            "received": received,
-            "lost": computed_lost,  # ← derived; we removed all mid-minute lost+= increments
-        }
-        print(json.dumps(result))
-        publish_mqtt(agent_id, result)
-
-        # Reset per-minute accumulators for the next window
-        current_minute += 60
-        latencies.clear(); jitters.clear()
-        sent = 0; received = 0
-        prev_rtt = None
-        # We do NOT clear in_flight here; the sweep below keeps it tidy.
-        # (Even if some old seqs linger, they won't affect loss math anymore.)
-
-    # Fixed-rate SEND
-    if now_mono >= next_send:
-        t_send_ns = time.monotonic_ns()
-        probe = {"agent_id": agent_id, "seq": seq, "t_send_ns": t_send_ns}
-        frame = json.dumps(probe, separators=(",", ":")).encode("utf-8")
-
-        sent += 1  # count attempt as 'sent' even if a send error occurs (loss accounted at finalize)
+# bound once: skips the module attribute lookup on every call in the loops below
+_monotonic_ns = time.monotonic_ns
+_time = time.time
+
+# SEND thread: wakes on its exact absolute tick, so MQTT/DB/recv work on the main thread
+# can't delay or skew the probe cadence
+def send_loop() -> None:
+    global seq, sent_total
+    next_ns = _monotonic_ns()
+    while True:
+        sleep_until_ns(next_ns)
+        t_send_ns = _monotonic_ns()
+        # batched mode: send every overdue tick's worth of probes in a single syscall
+        due = 1
+        if send_batch is not None:
+            due = min(SEND_BATCH_MAX, (t_send_ns - next_ns) // PERIOD_NS + 1)
+
+        # mark in-flight BEFORE sending: on loopback the echo can reach the main thread
+        # before this thread gets to run again
+        for i in range(due):
+            in_flight[(seq + i) & 0xFFFF] = t_send_ns
+        n_ok = 0
         try:
-            sock.sendto(frame, (HOST, PORT))
-            in_flight[seq] = t_send_ns
+            if send_batch is not None:
+                # snapshot each patched frame; SendBatch copies them into its arena
+                frames = [bytes(build_frame((seq + i) & 0xFFFF, t_send_ns)) for i in range(due)]
+                n_ok = send_batch.send(sock, frames)
+            else:
+                sock.send(build_frame(seq, t_send_ns))
+                n_ok = 1
+        except ConnectionRefusedError:
+            pass  # pending ICMP port-unreachable (Agent B down); the recv path keeps the socket
         except Exception as e:
-            # WHY WE REMOVED 'lost += 1' HERE:
+            # WHY THERE IS NO 'lost += 1' HERE:
             # In Option A, send failures are naturally included in `sent - received`
             # at finalize, so incrementing 'lost' here would double-count.
+            # (Socket recovery is left to the recv path on the main thread.)
             print(f"[Agent A] send error: {e}")
-            try:
-                sock.close()
-            except Exception:
-                pass
-            sock = make_udp_socket(0.05)
-            prev_rtt = None
+        for i in range(n_ok, due):
+            in_flight[(seq + i) & 0xFFFF] = 0  # never left the host
 
-        seq = (seq + 1) & 0xFFFF
-        next_send = now_mono + PERIOD
+        # count attempts as 'sent' even if a send error occurs (loss accounted at finalize)
+        sent_total += due
+        seq = (seq + due) & 0xFFFF
+        next_ns += due * PERIOD_NS
+        if send_batch is None and next_ns <= t_send_ns:
+            next_ns = t_send_ns + PERIOD_NS  # skipped period(s): resume the cadence, don't burst
 
-    # Non-blocking RECV: process any echoes that are ready
+threading.Thread(target=send_loop, name="probe-send", daemon=True).start()
+
+# main (recv/aggregate) loop. It lives in a function so its per-echo state is held in
+# fast locals instead of module globals; only sock / seq / sent_total are shared with the
+# send thread.
+def run_probe_loop() -> None:
+    global sock
+    sent_mark = 0      # sent_total at the start of the current minute
+    # streaming per-minute stats: O(1) memory, O(1) finalize (no sample lists)
+    lat_min, lat_max, lat_sum, lat_n = inf, -inf, 0.0, 0
+    jit_min, jit_max, jit_sum, jit_n = inf, -inf, 0.0, 0
+    received = 0       # number of echoes that arrived within TIMEOUT_S this minute
+    # NOTE: there is NO running 'lost' counter anymore — we derive it at finalize.
+    prev_rtt = None
+
+    current_minute = int(time.time() // 60) * 60  # minute-aligned window
+    oldest_seq = 0                                # sweep cursor: every seq before it has been cleared
+    last_sweep_ns = time.monotonic_ns()
+    timeout_ms = TIMEOUT_S * 1000.0
+    # hot-path names bound to locals
+    flight = in_flight
+    unpack_from = PROBE.unpack_from
+    probe_size = PROBE.size
+    monotonic_ns, wall = _monotonic_ns, _time
+
+    # non-blocking RECV, SWEEP, minute FINALIZE, then select() until the next event
     while True:
-        try:
-            data, addr = sock.recvfrom(65535)
-            recv_ns = time.monotonic_ns()
-            obj = json.loads(data.decode("utf-8"))
-            mseq = obj.get("seq")
-            tsend = in_flight.pop(mseq, None)
-            if tsend is not None:
-                rtt_ms = (recv_ns - tsend) / 1e6
-                if rtt_ms <= TIMEOUT_S * 1000.0:
-                    # on-time echo → count as received, update latency/jitter
-                    latencies.append(rtt_ms)
-                    if prev_rtt is not None:
-                        jitters.append(abs(rtt_ms - prev_rtt))
-                    prev_rtt = rtt_ms
-                    received += 1
+        # one clock read per wakeup, taken right after select() returns; reused below
+        now_ns = monotonic_ns()
+        now_wall = wall()
+        recv_ns = now_ns
+
+        # Non-blocking RECV: process any echoes that are ready
+        while True:
+            try:
+                if recv_batch is not None:
+                    # recvmmsg(): up to RECV_BATCH_MAX echoes per syscall, no exception when empty
+                    n_ready = recv_batch.recv(sock)
+                    echoes = [recv_batch.datagram(i) for i in range(n_ready)]
                 else:
-                    # WHY WE DO NOTHING FOR LATE ECHO HERE:
-                    # Late (> TIMEOUT_S) does NOT increment 'received', so at finalize
-                    # it will be counted as 'lost = sent - received'. Adding 'lost += 1'
-                    # here would double-count relative to finalize.
+                    nbytes = sock.recv_into(recv_view)
+                    echoes = (recv_view[:nbytes],)
+                for data in echoes:
+                    if len(data) != probe_size:
+                        continue  # not one of our probes
+                    version, _aid, mseq, tsend_echoed = unpack_from(data)
+                    tsend = flight[mseq]
+                    if version != PROBE_VERSION or tsend == 0 or tsend != tsend_echoed:
+                        continue  # stray, duplicate, or already-swept echo
+                    flight[mseq] = 0
+                    if tsend >= recv_ns:  # probe went out after our cached wakeup time: re-read the clock
+                        recv_ns = monotonic_ns()
+                    rtt_ms = (recv_ns - tsend) / 1e6
+                    if rtt_ms <= timeout_ms:
+                        # on-time echo → count as received, update latency/jitter
+                        lat_min = rtt_ms if rtt_ms < lat_min else lat_min
+                        lat_max = rtt_ms if rtt_ms > lat_max else lat_max
+                        lat_sum += rtt_ms
+                        lat_n += 1
+                        if prev_rtt is not None:
+                            jit = abs(rtt_ms - prev_rtt)
+                            jit_min = jit if jit < jit_min else jit_min
+                            jit_max = jit if jit > jit_max else jit_max
+                            jit_sum += jit
+                            jit_n += 1
+                        prev_rtt = rtt_ms
+                        received += 1
+                    else:
+                        # WHY WE DO NOTHING FOR LATE ECHO HERE:
+                        # Late (> TIMEOUT_S) does NOT increment 'received', so at finalize
+                        # it will be counted as 'lost = sent - received'. Adding 'lost += 1'
+                        # here would double-count relative to finalize.
+                        pass
+                if recv_batch is not None and n_ready < RECV_BATCH_MAX:
+                    break  # a short batch means the queue is empty; a full one keeps draining
+                recv_ns = monotonic_ns()  # anything read after this pass arrived later than the wakeup
+            except BlockingIOError:
+                break  # drained everything that was ready
+            except ConnectionRefusedError:
+                # ICMP port-unreachable reported on the connected socket: Agent B is down.
+                # Keep the socket and keep draining; the missing echo is loss at finalize.
+                continue
+            except Exception as e:
+                print(f"[Agent A] recv error: {e}")
+                try:
+                    sock.close()
+                except Exception:
                     pass
-        except socket.timeout:
-            break
-        except Exception as e:
-            print(f"[Agent A] recv error: {e}")
-            try:
-                sock.close()
-            except Exception:
-                pass
-            sock = make_udp_socket(0.05)
-            prev_rtt = None
-            break
-
-    # Timeout SWEEP — memory hygiene ONLY (no loss math here in Option A)
-    now_ns = time.monotonic_ns()
-    if (now_ns - last_sweep_ns) >= SWEEP_NS:
-        expired = [s for s, ts in list(in_flight.items())
-                   if (now_ns - ts) >= int(TIMEOUT_S * 1e9)]
-        if expired:
-            for s in expired:
-                in_flight.pop(s, None)
-            # WHY WE REMOVED 'lost += len(expired)' HERE:
+                sock = make_udp_socket()
+                prev_rtt = None
+                break
+
+        # Timeout SWEEP — memory hygiene ONLY (no loss math here in Option A)
+        if (now_ns - last_sweep_ns) >= SWEEP_NS:
+            # Walk only the outstanding window [oldest_seq, seq). Probes are sent in seq order,
+            # so the first entry that is still live ends the walk. Since RATE_HZ * TIMEOUT_S
+            # is far below 65536, a wrapped seq never aliases a live entry.
+            newest = seq  # snapshot; the send thread keeps advancing it
+            expire_before = now_ns - TIMEOUT_NS  # one subtraction per sweep, not per entry
+            while oldest_seq != newest:
+                ts = flight[oldest_seq]
+                if ts > expire_before:
+                    break
+                flight[oldest_seq] = 0
+                oldest_seq = (oldest_seq + 1) & 0xFFFF
+            # WHY THERE IS NO 'lost += expired' HERE:
             # Option A computes loss solely at finalize (sent - received).
             # Incrementing here would double-count against finalize.
-        last_sweep_ns = now_ns
+            last_sweep_ns = now_ns
+
+        # Minute finalize WITH +TIMEOUT_S grace so on-time late echoes can still be counted.
+        if now_wall >= current_minute + 60 + TIMEOUT_S:
+            # OPTION A: compute lost exactly once here
+            sent = sent_total - sent_mark
+            sent_mark += sent
+            computed_lost = max(0, sent - received)
+            lat_stats = summarize(lat_min, lat_max, lat_sum, lat_n)
+            jit_stats = summarize(jit_min, jit_max, jit_sum, jit_n)
+
+            result = {
+                "agent_id": agent_id,
+                "time": minute_iso(current_minute),
+                "latency_min_ms": lat_stats[0],
+                "latency_max_ms": lat_stats[1],
+                "latency_avg_ms": lat_stats[2],
+                "jitter_min_ms":  jit_stats[0],
+                "jitter_max_ms":  jit_stats[1],
+                "jitter_avg_ms":  jit_stats[2],
+                "sent": sent,
+                "received": received,
+                "lost": computed_lost,  # ← derived; we removed all mid-minute lost+= increments
+            }
+            print(json.dumps(result))
+            publish_mqtt(mqtt_topic, json.dumps(result, separators=(",", ":")).encode("utf-8"))
+
+            # Reset per-minute accumulators for the next window
+            current_minute += 60
+            lat_min, lat_max, lat_sum, lat_n = inf, -inf, 0.0, 0
+            jit_min, jit_max, jit_sum, jit_n = inf, -inf, 0.0, 0
+            received = 0
+            prev_rtt = None
+            # We do NOT clear in_flight here; the sweep keeps it tidy.
+            # (Even if some old seqs linger, they won't affect loss math anymore.)
+
+        # Sleep in select() until an echo arrives, the next sweep is due, or the minute closes.
+        # If the socket is already readable, select returns at once and the next pass drains it.
+        timeout = max(0.0, min((last_sweep_ns + SWEEP_NS - now_ns) / 1e9,
+                               current_minute + 60 + TIMEOUT_S - now_wall))
+        select.select([sock], [], [], timeout)
 
-    time.sleep(0.002)  # prevent busy spin
+run_probe_loop()
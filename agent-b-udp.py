@@ -2,24 +2,41 @@
 # -*- coding: utf-8 -*-
 """
 Agent B (UDP) — Echo server + MQTT subscriber → SQLite
-- UDP echo server (background thread): verbatim echo of incoming datagrams.
-- MQTT subscriber (main thread): consumes minute aggregates and UPSERTs into SQLite.
+- UDP echo server (background thread): verbatim echo of incoming datagrams. Set
+  UDP_WORKERS=N to run N SO_REUSEPORT sockets and let the kernel spread senders over them.
+- MQTT subscriber (main thread): parses minute aggregates and queues them.
+- DB writer (background thread): one persistent SQLite connection, batched UPSERTs.
 """
 
-import socket, threading, json, sqlite3
+import os, socket, threading, sqlite3, queue, time
 from contextlib import closing
 from pathlib import Path
 from paho.mqtt import client as mqtt
+from minute_stats import parse_minute_row
+from udp_mmsg import HAVE_RECVMMSG, HAVE_SENDMMSG, EchoBatch, set_socket_buffers
 
 # Configration
 UDP_HOST = "0.0.0.0"
 UDP_PORT = 4401
+ECHO_BATCH_MAX = 32   # datagrams per recvmmsg()/sendmmsg() round (Linux)
+SOCK_BUF_BYTES = 2 << 20  # 2 MB send/recv buffers so bursts aren't dropped silently
+# echo workers; >1 binds the port with SO_REUSEPORT so the kernel shards senders across them.
+# Off by default: each Agent A is one 4-tuple (lands on one worker), and reuseport also lets a
+# second Agent B instance bind the port silently instead of failing with EADDRINUSE.
+UDP_WORKERS = int(os.environ.get("UDP_WORKERS", "1"))
+if not hasattr(socket, "SO_REUSEPORT"):
+    UDP_WORKERS = 1
 
 MQTT_HOST = "127.0.0.1"
 MQTT_PORT = 1883
 MQTT_TOPIC = "netstats/+/minute"   # all agents’ minute topics
 
 DB_PATH = Path("netstats.db")
+DB_QUEUE_MAX = 1024   # rows buffered between the MQTT callback and the writer
+DB_BATCH_MAX = 64     # rows per transaction
+DB_FLUSH_S = 1.0      # max wait to fill a batch after its first row
+
+db_queue = queue.Queue(maxsize=DB_QUEUE_MAX)
 
 # add  Schema for SQLite
 SCHEMA_SQL = """
@@ -65,18 +82,73 @@ def init_db() -> None:
         conn.executescript(SCHEMA_SQL)
         conn.commit()
 
-#  UDP Echo Server (runs forever) 
-def udp_echo_server() -> None:
+#  UPSERT one batch in a single transaction (executemany reuses one prepared statement)
+def _write_batch(conn: sqlite3.Connection, rows: list) -> None:
+    try:
+        conn.execute("BEGIN")
+        conn.executemany(UPSERT_SQL, rows)
+        conn.execute("COMMIT")
+        for r in rows:
+            print(f"[DB] upserted {r[0]} @ {r[1]}")
+    except Exception as e:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        print(f"[DB] batch of {len(rows)} failed: {e}")
+
+#  DB writer (runs until a None sentinel is queued): drain the queue and write in batches
+def db_writer() -> None:
+    conn = sqlite3.connect(str(DB_PATH), isolation_level=None)  # explicit BEGIN/COMMIT
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")     # fsync at checkpoints, not every commit
+    conn.execute("PRAGMA cache_size=-8000")       # ~8 MB page cache
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA wal_autocheckpoint=1000")
+    stopping = False
+    try:
+        while not stopping:
+            row = db_queue.get()  # block until there is work
+            if row is None:
+                break
+            rows = [row]
+            deadline = time.monotonic() + DB_FLUSH_S
+            while len(rows) < DB_BATCH_MAX:
+                remaining = deadline - time.monotonic()
+                try:
+                    row = db_queue.get(timeout=remaining) if remaining > 0 else db_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if row is None:
+                    stopping = True
+                    break
+                rows.append(row)
+            _write_batch(conn, rows)
+    finally:
+        # clean shutdown: fold the WAL back into the main DB file
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.close()
+
+#  UDP Echo Server worker (runs forever); with several workers each binds its own SO_REUSEPORT socket
+def udp_echo_server(worker_id: int = 0) -> None:
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    set_socket_buffers(sock, SOCK_BUF_BYTES)
+    if UDP_WORKERS > 1:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
     sock.bind((UDP_HOST, UDP_PORT))
-    print(f"[UDP] Echo server listening on {UDP_HOST}:{UDP_PORT}")
+    batch = EchoBatch(ECHO_BATCH_MAX) if (HAVE_RECVMMSG and HAVE_SENDMMSG) else None
+    mode = f"recvmmsg/sendmmsg x{ECHO_BATCH_MAX}" if batch is not None else "recvfrom_into/sendto"
+    print(f"[UDP] Echo worker {worker_id} listening on {UDP_HOST}:{UDP_PORT} ({mode})")
+    buf = bytearray(2048)     # fallback path: echo straight out of one reused buffer
+    mv = memoryview(buf)
     try:
         while True:  # << the crucial loop so it doesn't exit after one datagram
             try:
-                data, addr = sock.recvfrom(2048)     # small JSON probes
-                sock.sendto(data, addr)              # echo exact bytes back
-                # optional debug:
-                # print(f"[UDP] echoed {len(data)} bytes to {addr}")
+                if batch is not None:
+                    batch.echo(sock)                     # up to ECHO_BATCH_MAX datagrams per syscall pair
+                else:
+                    nbytes, addr = sock.recvfrom_into(mv)  # small probes, no bytes object
+                    sock.sendto(mv[:nbytes], addr)         # echo exact bytes back
+                    # optional debug:
+                    # print(f"[UDP] echoed {nbytes} bytes to {addr}")
             except Exception as e:
                 print(f"[UDP] echo error: {e}")
     finally:
@@ -96,28 +168,13 @@ def on_connect(client, userdata, flags, reason_code=None, properties=None):
 def on_subscribe(client, userdata, mid, reason_codes, properties=None):
     print(f"[MQTT] subscribed mid={mid}, reason_codes={reason_codes}")
     
-# process incoming messages , insert into SQLite DB
+# process incoming messages , queue rows for the DB writer (no SQLite work on the MQTT thread)
 def on_message(client, userdata, msg):
     try:
-        payload = json.loads(msg.payload.decode("utf-8"))
-        row = (
-            payload["agent_id"],
-            payload["time"],
-            float(payload["latency_min_ms"]),
-            float(payload["latency_max_ms"]),
-            float(payload["latency_avg_ms"]),
-            float(payload["jitter_min_ms"]),
-            float(payload["jitter_max_ms"]),
-            float(payload["jitter_avg_ms"]),
-            int(payload["sent"]),
-            int(payload["received"]),
-            int(payload["lost"]),
-        )
-        # insert into SQLite DB
-        with closing(sqlite3.connect(str(DB_PATH))) as conn:
-            conn.execute(UPSERT_SQL, row)
-            conn.commit()
-        print(f"[DB] upserted {payload['agent_id']} @ {payload['time']}")
+        row = parse_minute_row(msg.payload)
+        db_queue.put_nowait(row)
+    except queue.Full:
+        print(f"[DB] writer queue full, dropped {msg.payload!r}")
     except Exception as e:
         print(f"[MQTT] Bad message/DB error: {e} raw={msg.payload!r}")
 # make MQTT client to handle different Paho versions
@@ -142,12 +199,17 @@ def mqtt_subscriber_loop() -> None:
 # test connectivity, run agent_b.py first
 def main() -> None:
     init_db()
-    t = threading.Thread(target=udp_echo_server, daemon=True)
-    t.start()
+    writer = threading.Thread(target=db_writer, daemon=True)
+    writer.start()
+    for worker_id in range(UDP_WORKERS):
+        threading.Thread(target=udp_echo_server, args=(worker_id,), daemon=True).start()
     try:
         mqtt_subscriber_loop()
     except KeyboardInterrupt:
         print("\n[Agent B] Stopping...")
+    finally:
+        db_queue.put(None)  # flush queued rows, checkpoint the WAL, close the DB
+        writer.join(timeout=DB_FLUSH_S + 5)
 
 if __name__ == "__main__":
     main()
@@ -2,12 +2,16 @@
 # Agent A - Probe Client + Per-Minute Aggregation + MQTT Publisher
 
 import json
+import selectors
 import socket
+import struct
 import time
 import uuid
-from statistics import mean
+from collections import deque
+from math import inf
 from pathlib import Path
 from paho.mqtt import client as mqtt
+from minute_stats import minute_iso, summarize
 
 # Config 
 HOST = "127.0.0.1"
@@ -16,10 +20,19 @@ RATE_HZ = 2.0
 TIMEOUT_S = 2.0
 PERIOD = 1.0 / RATE_HZ
 
+SOCK_BUF_BYTES = 16384   # probes are 10 bytes; the multi-MB autotuned default only wastes kernel memory
+# Linux-only: ACK immediately instead of delayed-ACK (the kernel may drop back, so it is re-armed per recv)
+TCP_QUICKACK = getattr(socket, "TCP_QUICKACK", None)
+
 MQTT_HOST = "127.0.0.1"
 MQTT_PORT = 1883
 STATE_DIR = Path.home() / ".agent_a"
 
+# Binary probe frame (fixed size, no delimiter): seq (uint16) | t_send_ns (uint64), network byte order
+PROBE = struct.Struct("!HQ")
+PROBE_SIZE = PROBE.size  # 10 bytes
+probe_buf = bytearray(PROBE_SIZE)  # reused for every probe (pack_into, no per-send bytes object)
+
 # creating a unique agent ID and storing it in a file
 def load_or_create_agent_id(state_dir: Path = STATE_DIR) -> str:
     state_dir.mkdir(parents=True, exist_ok=True)
@@ -30,14 +43,23 @@ def load_or_create_agent_id(state_dir: Path = STATE_DIR) -> str:
     id_file.write_text(aid)
     return aid
 
-# publish to MQTT broker
+# log broker drops; Paho's network thread reconnects on its own
+def on_disconnect(client, userdata, disconnect_flags, reason_code, properties=None):
+    print(f"[MQTT] disconnected rc={getattr(reason_code, 'value', reason_code)}; reconnecting in background")
+
+# one persistent MQTT client for the whole run (no CONNECT/DISCONNECT per minute)
+def start_mqtt_client() -> mqtt.Client:
+    client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2, clean_session=True)
+    client.on_disconnect = on_disconnect
+    client.connect_async(MQTT_HOST, MQTT_PORT, keepalive=60)
+    client.loop_start()  # background thread: network I/O + automatic reconnect
+    return client
+
+# publish to MQTT broker (QoS0: queued for the network thread, never waits)
 def publish_mqtt(agent_id: str, payload: dict):
     topic = f"netstats/{agent_id}/minute"
-    client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2)
     try:
-        client.connect(MQTT_HOST, MQTT_PORT, keepalive=10)
-        client.publish(topic, json.dumps(payload), qos=0, retain=False)  # QoS0, no retain
-        client.disconnect()
+        _mqtt.publish(topic, json.dumps(payload), qos=0, retain=False)  # QoS0, no retain
     except Exception as e:
         print(f"[MQTT] publish failed: {e}")
 
@@ -50,145 +72,186 @@ def connect_with_backoff(host: str, port: int, timeout_s: float) -> socket.socke
             s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             s.settimeout(timeout_s)
             s.connect((host, port))
+            # Back to plain blocking mode: recv only runs after the selector reports the socket
+            # readable, so it needs no timeout. sendall() does: SO_SNDTIMEO (set once) makes a
+            # peer that stopped reading fail the send (-> reconnect) instead of blocking forever.
+            s.setblocking(True)
+            sec = int(timeout_s)
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO,
+                         struct.pack("ll", sec, int((timeout_s - sec) * 1e6)))
             # Flush small frames immediately
             s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if TCP_QUICKACK is not None:
+                s.setsockopt(socket.IPPROTO_TCP, TCP_QUICKACK, 1)
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCK_BUF_BYTES)
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCK_BUF_BYTES)
             print(f"[Agent A] Connected to Agent B {host}:{port}")
             return s
         except Exception as e:
             print(f"[Agent A] Connection failed: {e} (retry in {delay}s)")
             time.sleep(delay)
             delay = min(delay * 2, 5.0)
-# read exactly one line with timeout
-def recv_line(sock: socket.socket, timeout_s: float) -> bytes:
-    """Blocking read of exactly one newline-terminated frame, with timeout."""
-    sock.settimeout(timeout_s)
-    buf = bytearray()
-    while True:
-        chunk = sock.recv(4096)
-        if not chunk:
-            raise RuntimeError("peer closed")
-        buf += chunk
-        if b"\n" in buf:
-            line, _rest = buf.split(b"\n", 1)
-            return line + b"\n"
+# drop a broken connection and swap a fresh one into the selector
+def reconnect(sel: selectors.BaseSelector, sock: socket.socket) -> socket.socket:
+    sel.unregister(sock)
+    try:
+        sock.close()
+    except Exception:
+        pass
+    sock = connect_with_backoff(HOST, PORT, TIMEOUT_S)
+    sel.register(sock, selectors.EVENT_READ)
+    return sock
 
 # TCP echo server (for testing) 
 agent_id = load_or_create_agent_id()
+_mqtt = start_mqtt_client()
 sock = connect_with_backoff(HOST, PORT, TIMEOUT_S)
 print(f"[Agent A] Ready (agent_id={agent_id})")
 
 seq = 0
-latencies, jitters = [], []
+# streaming per-minute stats: no sample lists, no finalize-time passes
+lat_min, lat_max, lat_sum, lat_n = inf, -inf, 0.0, 0
+jit_min, jit_max, jit_sum, jit_n = inf, -inf, 0.0, 0
 sent = received = lost = 0
 prev_rtt = None
 
-current_minute = int(time.time() // 60) * 60
-
-while True:
-    now = time.time()
-
-    # finalize minute after +2s grace period
-    if now >= current_minute + 60 + TIMEOUT_S:
-        result = {
-            "agent_id": agent_id,
-            "time": time.strftime("%Y-%m-%dT%H:%M:00Z", time.gmtime(current_minute)),
-            "latency_min_ms": round(min(latencies), 3) if latencies else 0.0,
-            "latency_max_ms": round(max(latencies), 3) if latencies else 0.0,
-            "latency_avg_ms": round(mean(latencies), 3) if latencies else 0.0,
-            "jitter_min_ms":  round(min(jitters), 3) if jitters else 0.0,
-            "jitter_max_ms":  round(max(jitters), 3) if jitters else 0.0,
-            "jitter_avg_ms":  round(mean(jitters), 3) if jitters else 0.0,
-            "sent": sent,
-            "received": received,
-            "lost": lost,
-        }
-        print(json.dumps(result))
-        publish_mqtt(agent_id, result)
-
-        # reset for next minute
-        current_minute += 60
-        latencies.clear(); jitters.clear()
-        sent = received = lost = 0
-        prev_rtt = None
-
-    # send probe to Agent B
-    t_send_ns = time.monotonic_ns()
-    payload = {"seq": seq, "t_send_ns": t_send_ns}
-    frame = (json.dumps(payload) + "\n").encode()
-
-    # Count attempt first; failed send becomes 'lost'
-    sent += 1
-    try:
-        sock.sendall(frame)
-    except Exception as e:
-        print(f"[Agent A] send error: {e} (reconnecting)")
-        lost += 1  # attempted but couldn't be delivered → no echo will come
-        try:
-            sock.close()
-        except Exception:
-            pass
-        sock = connect_with_backoff(HOST, PORT, TIMEOUT_S)
-        prev_rtt = None  # avoid jitter spike
-        seq = (seq + 1) & 0xFFFF
-        time.sleep(PERIOD)
-        continue
-
-    #  Receive the matching echo (loop until match or timeout)  with precise timeout
-    deadline = time.monotonic() + TIMEOUT_S
-    matched = False
-    while True:
-        remaining = deadline - time.monotonic()
-        if remaining <= 0:
-            break  # ran out of time
+TIMEOUT_NS = int(TIMEOUT_S * 1e9)
+pending = deque()     # (seq, t_send_ns) in send order; TCP echoes come back in the same order
+# preallocated receive buffer: recv_into() fills it in place, no per-recv bytes objects
+rbuf = bytearray(65536)
+rview = memoryview(rbuf)
+rlen = 0              # bytes in rbuf not yet consumed as whole frames
 
-        try:
-            echo = recv_line(sock, remaining)   # use remaining time for precise deadline
-            recv_ns = time.monotonic_ns()
-            # parse JSON echo
-            obj = json.loads(echo.decode("utf-8").strip())
-
-            if obj.get("seq") == seq and obj.get("t_send_ns") == t_send_ns:
-                # matched the probe we just sent
-                rtt_ms = (recv_ns - t_send_ns) / 1e6
-                if rtt_ms <= TIMEOUT_S * 1000.0:
-                    latencies.append(rtt_ms)
-                    if prev_rtt is not None:
-                        jitters.append(abs(rtt_ms - prev_rtt))
-                    prev_rtt = rtt_ms
-                    received += 1
-                else:
-                    # late beyond SLA window → treat as lost
-                    lost += 1
-                matched = True
-                break
-            else:
-                # stray/old echo; ignore and keep looking within the deadline
-                continue
+sel = selectors.DefaultSelector()  # epoll on Linux
+sel.register(sock, selectors.EVENT_READ)
 
-        except socket.timeout:
-            # will exit on next loop when remaining<=0, but we can break now
-            break
-        except Exception as e:
-            print(f"[Agent A] recv error: {e} (reconnecting)")
-            # the probe we were waiting on won't get a valid echo anymore
-            lost += 1
-            try:
-                sock.close()
-            except Exception:
-                pass
-            sock = connect_with_backoff(HOST, PORT, TIMEOUT_S)
+# minute boundaries are tracked on the monotonic clock (immune to NTP steps);
+# wall time is only used once here and for the ISO label
+start_wall, start_mono_ns = time.time(), time.monotonic_ns()
+current_minute = int(start_wall // 60) * 60                                  # wall epoch of the open minute (label)
+minute_mono_ns = start_mono_ns + int((current_minute - start_wall) * 1e9)  # same instant, monotonic
+FINALIZE_NS = int((60 + TIMEOUT_S) * 1e9)
+next_tick = time.monotonic()
+
+try:
+    while True:
+        # finalize minute after +2s grace period
+        if time.monotonic_ns() >= minute_mono_ns + FINALIZE_NS:
+            lat_stats = summarize(lat_min, lat_max, lat_sum, lat_n)
+            jit_stats = summarize(jit_min, jit_max, jit_sum, jit_n)
+            result = {
+                "agent_id": agent_id,
+                "time": minute_iso(current_minute),
+                "latency_min_ms": lat_stats[0],
+                "latency_max_ms": lat_stats[1],
+                "latency_avg_ms": lat_stats[2],
+                "jitter_min_ms":  jit_stats[0],
+                "jitter_max_ms":  jit_stats[1],
+                "jitter_avg_ms":  jit_stats[2],
+                "sent": sent,
+                "received": received,
+                "lost": lost,
+            }
+            print(json.dumps(result))
+            publish_mqtt(agent_id, result)
+
+            # reset for next minute
+            current_minute += 60
+            minute_mono_ns += 60_000_000_000
+            lat_min, lat_max, lat_sum, lat_n = inf, -inf, 0.0, 0
+            jit_min, jit_max, jit_sum, jit_n = inf, -inf, 0.0, 0
+            sent = received = lost = 0
             prev_rtt = None
-            matched = True  # accounted as lost
-            break
 
-    if not matched:
-        # We never saw the matching echo within TIMEOUT_S
-        lost += 1
+        # send tick: probe Agent B
+        now_mono = time.monotonic()
+        if now_mono >= next_tick:
+            # absolute schedule: the next tick doesn't inherit this iteration's lateness;
+            # after a long stall (reconnect backoff) restart the grid instead of bursting
+            next_tick += PERIOD
+            if next_tick <= now_mono:
+                next_tick = now_mono + PERIOD
+            t_send_ns = time.monotonic_ns()
+            PROBE.pack_into(probe_buf, 0, seq, t_send_ns)
 
-    # Next probe 
-    seq = (seq + 1) & 0xFFFF
-    time.sleep(PERIOD)
+            # Count attempt first; failed send becomes 'lost'
+            sent += 1
+            try:
+                sock.sendall(probe_buf)
+                pending.append((seq, t_send_ns))
+            except Exception as e:
+                print(f"[Agent A] send error: {e} (reconnecting)")
+                # this probe plus everything still in flight on the old connection is gone
+                lost += 1 + len(pending)
+                pending.clear()
+                rlen = 0
+                sock = reconnect(sel, sock)
+                prev_rtt = None  # avoid jitter spike
+            seq = (seq + 1) & 0xFFFF
 
+        # expire probes whose echo did not arrive within TIMEOUT_S
+        now_ns = time.monotonic_ns()
+        while pending and now_ns - pending[0][1] >= TIMEOUT_NS:
+            pending.popleft()
+            lost += 1
 
+        # wait for an echo, the next send tick, or the oldest probe's deadline
+        wake = next_tick
+        if pending:
+            wake = min(wake, (pending[0][1] + TIMEOUT_NS) / 1e9)
+        events = sel.select(max(wake - time.monotonic(), 0.0))
+        if not events:
+            continue
 
+        try:
+            n = sock.recv_into(rview[rlen:])
+            recv_ns = time.monotonic_ns()
+            if n == 0:
+                raise RuntimeError("peer closed")
+            if TCP_QUICKACK is not None:
+                sock.setsockopt(socket.IPPROTO_TCP, TCP_QUICKACK, 1)
+        except Exception as e:
+            print(f"[Agent A] recv error: {e} (reconnecting)")
+            # probes in flight on this connection won't get a valid echo anymore
+            lost += len(pending)
+            pending.clear()
+            rlen = 0
+            sock = reconnect(sel, sock)
+            prev_rtt = None
+            continue
 
+        rlen += n
+        whole = rlen - rlen % PROBE_SIZE
+        for off in range(0, whole, PROBE_SIZE):
+            # unpack binary echo
+            seq_e, ts_e = PROBE.unpack_from(rbuf, off)
+            if not pending or pending[0] != (seq_e, ts_e):
+                # stray/old echo (its probe already expired); ignore
+                continue
+            pending.popleft()
+            rtt_ms = (recv_ns - ts_e) / 1e6
+            if rtt_ms <= TIMEOUT_S * 1000.0:
+                lat_min = rtt_ms if rtt_ms < lat_min else lat_min
+                lat_max = rtt_ms if rtt_ms > lat_max else lat_max
+                lat_sum += rtt_ms
+                lat_n += 1
+                if prev_rtt is not None:
+                    jit = abs(rtt_ms - prev_rtt)
+                    jit_min = jit if jit < jit_min else jit_min
+                    jit_max = jit if jit > jit_max else jit_max
+                    jit_sum += jit
+                    jit_n += 1
+                prev_rtt = rtt_ms
+                received += 1
+            else:
+                # late beyond SLA window → treat as lost
+                lost += 1
+        # move a partial trailing frame (< PROBE_SIZE bytes) to the front
+        if whole < rlen:
+            rbuf[:rlen - whole] = rbuf[whole:rlen]
+        rlen -= whole
+finally:
+    sel.close()
+    # flush the DISCONNECT through the network thread, then stop it
+    _mqtt.disconnect()
+    _mqtt.loop_stop()
@@ -4,15 +4,19 @@
 
 import socket
 import threading
-import json
 import sqlite3
+import queue
+import time
 from contextlib import closing
 from pathlib import Path
 from paho.mqtt import client as mqtt
+from minute_stats import parse_minute_row
 
 # TCP echo server config
 TCP_HOST = "0.0.0.0"
 TCP_PORT = 4401
+SOCK_BUF_BYTES = 16384   # per-connection SO_RCVBUF/SO_SNDBUF; plenty for 10-byte probes
+TCP_QUICKACK = getattr(socket, "TCP_QUICKACK", None)   # Linux-only; re-armed after every recv
 
 # MQTT config
 MQTT_HOST = "127.0.0.1"
@@ -21,6 +25,10 @@ MQTT_TOPIC = "netstats/+/minute"   # receive all agents' minute stats
 
 # SQLite config
 DB_PATH = Path("netstats.db")
+DB_QUEUE_MAX = 1024   # rows buffered between the MQTT callback and the writer
+DB_BATCH_MAX = 64     # rows per transaction
+DB_FLUSH_S = 1.0      # max wait to fill a batch after its first row
+db_queue = queue.Queue(maxsize=DB_QUEUE_MAX)
 
 SCHEMA_SQL = """
 CREATE TABLE IF NOT EXISTS minute_stats (
@@ -56,29 +64,72 @@ ON CONFLICT(agent_id, minute_utc) DO UPDATE SET
   received=excluded.received,
   lost=excluded.lost;
 """
-# initialize DB if not exists
+# initialize DB if not exists (schema only; the writer thread owns the long-lived connection)
 def init_db():
     with closing(sqlite3.connect(str(DB_PATH))) as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
         conn.executescript(SCHEMA_SQL)
         conn.commit()
 
+# UPSERT one batch in a single transaction (one fsync per batch, one prepared statement)
+def _write_batch(conn, rows):
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany(UPSERT_SQL, rows)
+        conn.execute("COMMIT")
+        for r in rows:
+            print(f"[DB] upserted {r[0]} @ {r[1]}")
+    except Exception as e:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        print(f"[DB] batch of {len(rows)} failed: {e}")
+
+# DB writer thread: opens, owns and closes the connection; drains db_queue until a None sentinel
+def db_writer():
+    conn = sqlite3.connect(str(DB_PATH), isolation_level=None)  # explicit BEGIN/COMMIT
+    conn.execute("PRAGMA journal_mode=WAL")     # no rollback-journal create/fsync/delete per commit
+    conn.execute("PRAGMA synchronous=NORMAL")   # fsync at WAL checkpoints, not every commit
+    conn.execute("PRAGMA temp_store=MEMORY")
+    stopping = False
+    try:
+        while not stopping:
+            row = db_queue.get()
+            if row is None:
+                break
+            rows = [row]
+            deadline = time.monotonic() + DB_FLUSH_S
+            while len(rows) < DB_BATCH_MAX:
+                remaining = deadline - time.monotonic()
+                try:
+                    row = db_queue.get(timeout=remaining) if remaining > 0 else db_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if row is None:
+                    stopping = True
+                    break
+                rows.append(row)
+            _write_batch(conn, rows)
+    finally:
+        # fold the WAL back into netstats.db so no -wal/-shm files are left behind
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.close()
+
 # TCP echo server handlers
 
 def handle_conn(conn, addr):
-    """Handle one TCP connection; echo each line back verbatim."""
+    """Handle one TCP connection; echo every received chunk back verbatim (Agent A reassembles frames)."""
     try:
         # Flush small frames immediately (avoid Nagle delays)
         conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-        buf = b""
+        conn.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCK_BUF_BYTES)
+        conn.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCK_BUF_BYTES)
         while True:
             chunk = conn.recv(4096)
             if not chunk:
                 break
-            buf += chunk
-            # Echo per line (newline-delimited JSON)
-            while b"\n" in buf:
-                line, buf = buf.split(b"\n", 1)
-                conn.sendall(line + b"\n")
+            if TCP_QUICKACK is not None:
+                conn.setsockopt(socket.IPPROTO_TCP, TCP_QUICKACK, 1)   # no delayed ACK on the echo path
+            conn.sendall(chunk)
     finally:
         conn.close()
         
@@ -94,7 +145,9 @@ def echo_server():
         while True:
             conn, addr = server.accept()
             print(f"[TCP] Connected by {addr}")
-            t = threading.Thread(target=handle_conn, args=(conn, addr), daemon=True)
+            # one daemon thread per long-lived Agent A connection: no cap on concurrent agents,
+            # and nothing to join at exit
+            t = threading.Thread(target=handle_conn, args=(conn, addr), name="echo", daemon=True)
             t.start()
     finally:
         server.close()
@@ -114,28 +167,13 @@ def on_connect(client, userdata, flags, reason_code, properties=None):
 def on_subscribe(client, userdata, mid, reason_codes, properties=None):
     print(f"[MQTT] subscribed mid={mid}, reason_codes={reason_codes}")
     
-# process incoming messages , insert into SQLite DB
+# process incoming messages , queue rows for the DB writer thread
 def on_message(client, userdata, msg):
     try:
-        payload = json.loads(msg.payload.decode("utf-8"))
-        # Build row and UPSERT
-        row = (
-            payload["agent_id"],
-            payload["time"],
-            float(payload["latency_min_ms"]),
-            float(payload["latency_max_ms"]),
-            float(payload["latency_avg_ms"]),
-            float(payload["jitter_min_ms"]),
-            float(payload["jitter_max_ms"]),
-            float(payload["jitter_avg_ms"]),
-            int(payload["sent"]),
-            int(payload["received"]),
-            int(payload["lost"]),
-        )
-        with closing(sqlite3.connect(str(DB_PATH))) as conn:
-            conn.execute(UPSERT_SQL, row)
-            conn.commit()
-        print(f"[DB] upserted {payload['agent_id']} @ {payload['time']}")
+        row = parse_minute_row(msg.payload)
+        db_queue.put_nowait(row)
+    except queue.Full:
+        print(f"[DB] writer queue full, dropped {msg.payload!r}")
     except Exception as e:
         print(f"[MQTT] Bad message/DB error: {e} raw={msg.payload!r}")
         
@@ -151,6 +189,9 @@ def mqtt_subscriber_loop():
 def main():
     # initialize DB 
     init_db()
+    # Start the DB writer (batches UPSERTs off the MQTT thread)
+    writer = threading.Thread(target=db_writer, daemon=True)
+    writer.start()
     # Start TCP echo server in a background thread
     t = threading.Thread(target=echo_server, daemon=True)
     t.start()
@@ -159,6 +200,9 @@ def main():
         mqtt_subscriber_loop()
     except KeyboardInterrupt:
         print("\n[Agent B] Stopping...")
+    finally:
+        db_queue.put(None)  # flush queued rows, checkpoint the WAL, close the DB
+        writer.join(timeout=DB_FLUSH_S + 5)
 
 if __name__ == "__main__":
     main()
@@ -2,24 +2,78 @@
 # Flask viewer for Mini-Project (templates split)
 
 from __future__ import annotations
+import json
+import os
+import queue
 import sqlite3
-from contextlib import closing
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from flask import Flask, jsonify, request, render_template
+from flask import Flask, Response, g, jsonify, request, render_template
+try:
+    import orjson  # fast C encoder for the series payload
+except ImportError:
+    orjson = None
 
 DB_PATH = Path("netstats.db")
 
 app = Flask(__name__)
+# Idle, already-configured SQLite connections. A request checks one out on first query and
+# returns it at app-context teardown, so connections (and their PRAGMAs) outlive the thread
+# that used them: Werkzeug's threaded dev server starts a new thread per request, so a
+# per-thread connection would never be reused there. The pool grows to peak concurrency.
+_pool: queue.LifoQueue = queue.LifoQueue()
+
+def _open_conn() -> sqlite3.Connection:
+    conn = sqlite3.connect(str(DB_PATH), check_same_thread=False)  # handed between threads via _pool
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")  # readers never block Agent B's writer
+    conn.execute("PRAGMA mmap_size=268435456")  # map up to 256 MB: page reads without pread()
+    conn.execute("PRAGMA cache_size=-65536")    # ~64 MB page cache
+    return conn
+
+def _conn() -> sqlite3.Connection:
+    """This request's connection: a pooled one if idle, else a newly configured one."""
+    conn = g.get("db")
+    if conn is None:
+        try:
+            conn = _pool.get_nowait()
+        except queue.Empty:
+            conn = _open_conn()
+        g.db = conn
+    return conn
+
+@app.teardown_appcontext
+def _release_conn(exc):
+    conn = g.pop("db", None)
+    if conn is not None:
+        _pool.put(conn)
 
 def q(sql: str, params: tuple = ()) -> list[dict]:
     """Run a read-only query and return a list of dict rows."""
     if not DB_PATH.exists():
         return []
-    with closing(sqlite3.connect(str(DB_PATH))) as conn:
-        conn.row_factory = sqlite3.Row
-        cur = conn.execute(sql, params)
-        return [dict(r) for r in cur.fetchall()]
+    return [dict(r) for r in _conn().execute(sql, params)]
+
+def q_columns(sql: str, params: tuple = ()) -> dict[str, list]:
+    """Run a read-only query and return one value list per column ({name: [v0, v1, ...]})."""
+    if not DB_PATH.exists():
+        return {}
+    cur = _conn().execute(sql, params)
+    names = [d[0] for d in cur.description]
+    cols = [[] for _ in names]
+    # stream in fetchmany() batches straight into the columns (no full fetchall() copy)
+    while True:
+        batch = cur.fetchmany(512)
+        if not batch:
+            break
+        for col, values in zip(cols, zip(*batch)):
+            col.extend(values)
+    return dict(zip(names, cols))
+
+def json_response(obj) -> Response:
+    """Encode with orjson when available (falls back to the json module)."""
+    body = orjson.dumps(obj) if orjson is not None else json.dumps(obj)
+    return Response(body, mimetype="application/json")
 
 @app.get("/")
 def index():
@@ -44,7 +98,7 @@ def api_series():
     if not agent_id:
         last = q("SELECT agent_id FROM minute_stats ORDER BY minute_utc DESC LIMIT 1")
         if not last:
-            return jsonify({"rows": [], "agent_id": "", "since": ""})
+            return json_response({"columns": {}, "agent_id": "", "since": ""})
         agent_id = last[0]["agent_id"]
 
     # compute lower bound (aligned to minute) and fetch rows
@@ -52,7 +106,8 @@ def api_series():
     since = now - timedelta(minutes=minutes)
     since_iso = since.isoformat(timespec="minutes").replace("+00:00", "Z")
 
-    rows = q(
+    # columnar payload: one array per field, no per-row dicts or repeated keys
+    columns = q_columns(
         """
         SELECT minute_utc, latency_avg_ms, jitter_avg_ms, sent, received, lost
         FROM minute_stats
@@ -61,8 +116,10 @@ def api_series():
         """,
         (agent_id, since_iso),
     )
-    return jsonify({"rows": rows, "agent_id": agent_id, "since": since_iso})
+    return json_response({"columns": columns, "agent_id": agent_id, "since": since_iso})
 
 if __name__ == "__main__":
+    # dev server only; for real use run under gunicorn (see README):
+    #   gunicorn -w 2 -k gthread --threads 8 -b 0.0.0.0:5051 app:app
     # bind to 0.0.0.0 so your Windows browser can reach it from WSL
-    app.run(host="0.0.0.0", port=5051, debug=True)
+    app.run(host="0.0.0.0", port=5051, debug=os.environ.get("FLASK_DEBUG") == "1", threaded=True)
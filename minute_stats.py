@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Per-minute aggregate helpers shared by the TCP and UDP agents
+
+- summarize() / minute_iso(): close one minute window into stats + its ISO label (Agent A).
+- parse_minute_row(): MQTT minute payload (bytes) -> UPSERT row tuple (Agent B).
+"""
+
+import operator, time
+try:
+    from orjson import loads as json_loads   # C parser, takes the payload bytes as-is
+except ImportError:
+    from json import loads as json_loads     # stdlib accepts UTF-8 bytes too
+
+# (min, max, avg) from one minute's running accumulators; zeros if there were no samples
+def summarize(lo: float, hi: float, total: float, n: int) -> tuple:
+    if n == 0:
+        return 0.0, 0.0, 0.0
+    return round(lo, 3), round(hi, 3), round(total / n, 3)
+
+# ISO8601 label for a minute-aligned epoch. Windows advance by exactly 60s, so usually only
+# the MM digits change; strftime/gmtime run only at startup and when the hour rolls over.
+_iso_cache = [None, ""]   # [minute_epoch, label]
+def minute_iso(minute_epoch: int) -> str:
+    prev_epoch, prev = _iso_cache
+    if prev_epoch is not None and minute_epoch == prev_epoch + 60 and prev[14:16] != "59":
+        label = f"{prev[:14]}{int(prev[14:16]) + 1:02d}:00Z"
+    else:
+        label = time.strftime("%Y-%m-%dT%H:%M:00Z", time.gmtime(minute_epoch))
+    _iso_cache[0], _iso_cache[1] = minute_epoch, label
+    return label
+
+# payload keys in minute_stats column order
+ROW_FIELDS = operator.itemgetter(
+    "agent_id", "time",
+    "latency_min_ms", "latency_max_ms", "latency_avg_ms",
+    "jitter_min_ms", "jitter_max_ms", "jitter_avg_ms",
+    "sent", "received", "lost",
+)
+
+def parse_minute_row(payload_bytes: bytes) -> tuple:
+    """Parse one minute payload into an UPSERT row; raises on bad JSON or a missing field."""
+    (agent_id, minute_utc, lat_min, lat_max, lat_avg,
+     jit_min, jit_max, jit_avg, sent, received, lost) = ROW_FIELDS(json_loads(payload_bytes))
+    return (
+        agent_id,
+        minute_utc,
+        float(lat_min),
+        float(lat_max),
+        float(lat_avg),
+        float(jit_min),
+        float(jit_max),
+        float(jit_avg),
+        int(sent),
+        int(received),
+        int(lost),
+    )
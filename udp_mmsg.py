@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Batched UDP syscalls — sendmmsg(2) / recvmmsg(2) via ctypes (Linux only)
+
+- One syscall moves up to N datagrams instead of one send()/recv() per probe.
+- Buffers (frame arena, iovecs, mmsghdrs) are allocated once and reused.
+- HAVE_SENDMMSG / HAVE_RECVMMSG are False on non-Linux / libc without the
+  symbol; callers fall back to plain sock.send() / sock.recv() in that case.
+- set_socket_buffers() sizes SO_RCVBUF / SO_SNDBUF for both agents' UDP sockets.
+"""
+
+import ctypes, ctypes.util, errno, os, socket, sys
+
+# struct iovec / struct msghdr / struct mmsghdr (glibc, Linux)
+class iovec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p),
+                ("iov_len", ctypes.c_size_t)]
+
+class msghdr(ctypes.Structure):
+    _fields_ = [("msg_name", ctypes.c_void_p),
+                ("msg_namelen", ctypes.c_uint32),
+                ("msg_iov", ctypes.POINTER(iovec)),
+                ("msg_iovlen", ctypes.c_size_t),
+                ("msg_control", ctypes.c_void_p),
+                ("msg_controllen", ctypes.c_size_t),
+                ("msg_flags", ctypes.c_int)]
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", msghdr),
+                ("msg_len", ctypes.c_uint)]
+
+# bind libc once; leave the names None where the syscall is unavailable
+_libc = None
+if sys.platform.startswith("linux"):
+    try:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+    except OSError:
+        _libc = None
+
+_sendmmsg = getattr(_libc, "sendmmsg", None)
+if _sendmmsg is not None:
+    _sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int]
+    _sendmmsg.restype = ctypes.c_int
+
+_recvmmsg = getattr(_libc, "recvmmsg", None)
+if _recvmmsg is not None:
+    _recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int,
+                          ctypes.c_void_p]  # struct timespec* (always NULL here)
+    _recvmmsg.restype = ctypes.c_int
+
+HAVE_SENDMMSG = _sendmmsg is not None
+HAVE_RECVMMSG = _recvmmsg is not None
+
+MSG_WAITFORONE = 0x10000  # recvmmsg: block for the first datagram, then take only what is queued
+SOCKADDR_MAX = 128        # sizeof(struct sockaddr_storage)
+
+# Linux-only *FORCE variants ignore net.core.{r,w}mem_max but need CAP_NET_ADMIN
+# (not exported by the socket module)
+_BUF_OPTS = ((33 if sys.platform.startswith("linux") else None, socket.SO_RCVBUF),   # SO_RCVBUFFORCE
+             (32 if sys.platform.startswith("linux") else None, socket.SO_SNDBUF))   # SO_SNDBUFFORCE
+
+def set_socket_buffers(sock: socket.socket, size: int) -> None:
+    """Raise kernel send/receive buffers so short stalls queue datagrams instead of dropping them."""
+    for force_opt, opt in _BUF_OPTS:
+        if force_opt is not None:
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, force_opt, size)
+                continue
+            except OSError:
+                pass  # no CAP_NET_ADMIN: fall back to the clamped option
+        sock.setsockopt(socket.SOL_SOCKET, opt, size)
+
+def _raise_errno():
+    err = ctypes.get_errno()
+    raise OSError(err, os.strerror(err))
+
+# wire each mmsghdr to its own iovec, and each iovec to its own arena slot
+def _link(arena, iov, msgs, n: int, slot_size: int):
+    for i in range(n):
+        iov[i].iov_base = ctypes.addressof(arena[i])
+        iov[i].iov_len = slot_size
+        msgs[i].msg_hdr.msg_iov = ctypes.pointer(iov[i])
+        msgs[i].msg_hdr.msg_iovlen = 1
+
+# pre-allocated sendmmsg batch for a connected socket (no msg_name needed)
+class SendBatch:
+    def __init__(self, max_msgs: int, frame_size: int = 128):
+        if not HAVE_SENDMMSG:
+            raise OSError("sendmmsg(2) not available on this platform")
+        self.max_msgs = max_msgs
+        self.frame_size = frame_size
+        self._arena = ((ctypes.c_char * frame_size) * max_msgs)()
+        self._iov = (iovec * max_msgs)()
+        self._msgs = (mmsghdr * max_msgs)()
+        _link(self._arena, self._iov, self._msgs, max_msgs, frame_size)
+
+    def send(self, sock: socket.socket, frames) -> int:
+        """Copy frames into the arena and send them in one sendmmsg(); returns how many went out."""
+        n = len(frames)
+        if n > self.max_msgs:
+            raise ValueError(f"batch of {n} exceeds max_msgs={self.max_msgs}")
+        for i, frame in enumerate(frames):
+            size = len(frame)
+            if size > self.frame_size:
+                raise ValueError(f"frame of {size} bytes exceeds frame_size={self.frame_size}")
+            ctypes.memmove(self._arena[i], frame, size)
+            self._iov[i].iov_len = size
+        r = _sendmmsg(sock.fileno(), self._msgs, n, 0)
+        if r < 0:
+            _raise_errno()
+        return r
+
+# pre-allocated recvmmsg batch: drain up to max_msgs datagrams per non-blocking call
+class RecvBatch:
+    def __init__(self, max_msgs: int = 32, buf_size: int = 2048):
+        if not HAVE_RECVMMSG:
+            raise OSError("recvmmsg(2) not available on this platform")
+        self.max_msgs = max_msgs
+        self._bufs = ((ctypes.c_char * buf_size) * max_msgs)()
+        self._iov = (iovec * max_msgs)()
+        self._msgs = (mmsghdr * max_msgs)()
+        _link(self._bufs, self._iov, self._msgs, max_msgs, buf_size)
+        self._views = [memoryview(self._bufs[i]).cast("B") for i in range(max_msgs)]
+
+    def recv(self, sock: socket.socket, flags: int = socket.MSG_DONTWAIT) -> int:
+        """One recvmmsg(); returns the number of datagrams ready (0 if none)."""
+        r = _recvmmsg(sock.fileno(), self._msgs, self.max_msgs, flags, None)
+        if r < 0:
+            if ctypes.get_errno() in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return 0
+            _raise_errno()
+        return r
+
+    def datagram(self, i: int) -> memoryview:
+        """Zero-copy view of the i-th datagram from the last recv(); valid until the next recv()."""
+        return self._views[i][:self._msgs[i].msg_len]
+
+# recvmmsg() + sendmmsg() on an unconnected socket: every datagram goes back to its sender verbatim,
+# straight out of the receive buffers (no Python bytes objects on the echo path)
+class EchoBatch(RecvBatch):
+    def __init__(self, max_msgs: int = 32, buf_size: int = 2048):
+        if not HAVE_SENDMMSG:
+            raise OSError("sendmmsg(2) not available on this platform")
+        super().__init__(max_msgs, buf_size)
+        self.buf_size = buf_size
+        self._names = ((ctypes.c_char * SOCKADDR_MAX) * max_msgs)()
+        for i in range(max_msgs):
+            self._msgs[i].msg_hdr.msg_name = ctypes.addressof(self._names[i])
+            self._msgs[i].msg_hdr.msg_namelen = SOCKADDR_MAX
+
+    def echo(self, sock: socket.socket) -> int:
+        """Block for at least one datagram, echo the whole batch; returns how many were received."""
+        n = self.recv(sock, MSG_WAITFORONE)
+        if n == 0:
+            return 0
+        for i in range(n):
+            self._iov[i].iov_len = self._msgs[i].msg_len
+        r = _sendmmsg(sock.fileno(), self._msgs, n, 0)
+        # restore receive-side sizes (kernel rewrote msg_namelen; we shrank iov_len)
+        for i in range(n):
+            self._iov[i].iov_len = self.buf_size
+            self._msgs[i].msg_hdr.msg_namelen = SOCKADDR_MAX
+        if r < 0:
+            _raise_errno()
+        return n